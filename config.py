@@ -33,19 +33,51 @@ DIRECTORY_PATTERN = "{model} {scenario}/CMIP6 Files_{variable}/"
 COORDINATE_PRECISION = 2
 
 # Excel export settings
+# Single-sheet workbooks are written with xlsxwriter's constant_memory mode,
+# which requires rows to be written top-to-bottom, left-to-right (the writer
+# streams them in that order). Output split across several sheets is written
+# with an openpyxl write-only workbook.
 EXCEL_AGGREGATION = "mean"  # Options: "mean", "max", "min", "all"
 EXCEL_SHEET_NAME = "Data"
 EXCEL_MAX_ROWS_PER_SHEET = 1000000  # Excel limit is 1,048,576
 
 # NetCDF processing settings
+# Files are read with their on-disk chunking. These sizes are only used as
+# a fallback for variables stored contiguously (no chunk sizes in the file).
 CHUNK_SIZE = {
     'time': 365,
     'lat': 100,
     'lon': 100
 }
 
+# Number of threads used to aggregate files in parallel (one file per year)
+MAX_WORKERS = 8
+
+# Time steps read at once per file when aggregating files directly. Peak
+# memory is roughly MAX_WORKERS * TIME_BLOCK_SIZE * n_lat * n_lon * 8 bytes
+# (raw block plus float32 working copy); lower either value if memory is tight.
+TIME_BLOCK_SIZE = 31
+
+# Set to True if netCDF-C/HDF5 were built thread-safe; otherwise file access
+# is serialized and only the aggregation runs in parallel
+NETCDF_THREADSAFE = False
+
+# Cache of merged data for reruns (enabled with --cache)
+# Merged daily data is stored as Zarr, chunked for per-year aggregation over
+# the full grid. A cache is rebuilt if its input files change.
+CACHE_DIR = os.path.join(BASE_OUTPUT_PATH, "cache")
+CACHE_CHUNK_SIZE = {
+    'time': 365,
+    'lat': -1,
+    'lon': -1
+}
+
+# Output formats ("xlsx" is slowest to write; "csv" and "parquet" are much faster)
+AVAILABLE_OUTPUT_FORMATS = ["xlsx", "csv", "parquet"]
+DEFAULT_OUTPUT_FORMAT = "xlsx"
+
 # Output file naming
-OUTPUT_FILENAME_PATTERN = "{model}_{scenario}_{variable}.xlsx"
+OUTPUT_FILENAME_PATTERN = "{model}_{scenario}_{variable}.{extension}"
 OUTPUT_FILENAME_SEPARATOR = "_"  # Replace spaces with this in filenames
 
 
@@ -69,7 +101,12 @@ def get_input_directory(model: str, scenario: str, variable: str) -> Path:
     return Path(BASE_INPUT_PATH) / directory_name
 
 
-def get_output_path(model: str, scenario: str, variable: str) -> Path:
+def get_output_path(
+    model: str,
+    scenario: str,
+    variable: str,
+    output_format: str = None
+) -> Path:
     """
     Get the output file path for a given model, scenario, and variable.
     
@@ -77,10 +114,15 @@ def get_output_path(model: str, scenario: str, variable: str) -> Path:
         model: Model name (e.g., "ACCESS CM2")
         scenario: Scenario name (e.g., "SSP585")
         variable: Variable name (e.g., "tasmax")
+        output_format: File extension, one of AVAILABLE_OUTPUT_FORMATS
+                       (default: DEFAULT_OUTPUT_FORMAT)
     
     Returns:
         Path object for the output file
     """
+    if output_format is None:
+        output_format = DEFAULT_OUTPUT_FORMAT
+    
     # Clean model name for filename (replace spaces with separator)
     model_clean = model.replace(" ", OUTPUT_FILENAME_SEPARATOR)
     scenario_clean = scenario.replace(" ", OUTPUT_FILENAME_SEPARATOR)
@@ -88,7 +130,8 @@ def get_output_path(model: str, scenario: str, variable: str) -> Path:
     filename = OUTPUT_FILENAME_PATTERN.format(
         model=model_clean,
         scenario=scenario_clean,
-        variable=variable
+        variable=variable,
+        extension=output_format
     )
     
     # Ensure output directory exists
@@ -98,6 +141,27 @@ def get_output_path(model: str, scenario: str, variable: str) -> Path:
     return output_dir / filename
 
 
+def get_cache_path(model: str, scenario: str, variable: str) -> Path:
+    """
+    Get the Zarr cache path for a given model, scenario, and variable.
+    
+    Args:
+        model: Model name (e.g., "ACCESS CM2")
+        scenario: Scenario name (e.g., "SSP585")
+        variable: Variable name (e.g., "tasmax")
+    
+    Returns:
+        Path object for the cache store (may not exist yet)
+    """
+    model_clean = model.replace(" ", OUTPUT_FILENAME_SEPARATOR)
+    scenario_clean = scenario.replace(" ", OUTPUT_FILENAME_SEPARATOR)
+    
+    cache_dir = Path(CACHE_DIR)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    
+    return cache_dir / f"{model_clean}_{scenario_clean}_{variable}.zarr"
+
+
 def validate_paths():
     """
     Validate that base paths exist.
@@ -4,22 +4,30 @@ Main script for merging CMIP6 NetCDF files by coordinates into Excel format.
 Usage:
     python merge_nc_to_excel.py --model "ACCESS CM2" --scenario "SSP585" --variable "tasmax"
     python merge_nc_to_excel.py --model "ACCESS CM2" --scenario "SSP245" --variable "tasmin"
+    python merge_nc_to_excel.py --variable "pr" --output-format csv
+    python merge_nc_to_excel.py --variable "tasmax" --aggregation "max" --cache
 """
 
 import argparse
 import sys
 from pathlib import Path
 import config
-from utils.file_handler import discover_nc_files, get_file_info, validate_coordinate_consistency
-from utils.nc_reader import merge_nc_files, extract_coordinate_data, prepare_dataframe_data
-from utils.excel_writer import write_to_excel, validate_excel_file
+from utils.file_handler import get_file_info, validate_coordinate_consistency
+from utils.nc_reader import (
+    merge_nc_files, extract_coordinate_data, fast_aggregate, prepare_dataframe_data,
+    load_merge_cache, write_merge_cache, is_merge_cache_valid
+)
+from utils.excel_writer import write_to_excel, validate_excel_file, check_output_format
 
 
 def process_files(
     model: str,
     scenario: str,
     variable: str,
-    aggregation: str = None
+    aggregation: str = None,
+    strict_coords: bool = False,
+    output_format: str = None,
+    use_cache: bool = False
 ) -> Path:
     """
     Main processing function to merge NetCDF files and export to Excel.
@@ -29,9 +37,14 @@ def process_files(
         scenario: Scenario name (e.g., "SSP585")
         variable: Variable name (e.g., "tasmax")
         aggregation: Aggregation method (default from config)
+        strict_coords: Check that every file's lat/lon grid matches the
+                       first file's (within 0.01) and stop if it doesn't
+        output_format: "xlsx", "csv" or "parquet" (default from config)
+        use_cache: Read merged data from (or write it to) the Zarr cache
+                   in config.CACHE_DIR, so later runs skip the NetCDF reads
     
     Returns:
-        Path to the created Excel file
+        Path to the created output file
     
     Raises:
         FileNotFoundError: If input directory doesn't exist
@@ -39,6 +52,8 @@ def process_files(
     """
     if aggregation is None:
         aggregation = config.EXCEL_AGGREGATION
+    if output_format is None:
+        output_format = config.DEFAULT_OUTPUT_FORMAT
     
     print("=" * 70)
     print(f"CMIP6 NetCDF to Excel Merger")
@@ -47,20 +62,27 @@ def process_files(
     print(f"Scenario: {scenario}")
     print(f"Variable: {variable}")
     print(f"Aggregation: {aggregation}")
+    print(f"Output format: {output_format}")
     print("=" * 70)
     
+    # Fail before any reading if the output format can't be written
+    try:
+        check_output_format(output_format)
+    except ImportError as e:
+        print(f"ERROR: {e}")
+        sys.exit(1)
+    
     # Step 1: Discover files
     print("\n[Step 1] Discovering NetCDF files...")
     try:
-        files_with_years = discover_nc_files(model, scenario, variable)
+        # A single discovery pass provides both the file list and the info
+        file_info = get_file_info(model, scenario, variable)
+        files_with_years = file_info['files']
         file_paths = [fp for fp, _ in files_with_years]
         years = [yr for _, yr in files_with_years]
         
         print(f"Found {len(file_paths)} files")
         print(f"Year range: {min(years)} - {max(years)}")
-        
-        # Display file info
-        file_info = get_file_info(model, scenario, variable)
         print(f"Input directory: {file_info['input_directory']}")
         
     except (FileNotFoundError, ValueError) as e:
@@ -68,62 +90,104 @@ def process_files(
         sys.exit(1)
     
     # Step 2: Validate coordinate consistency (lightweight check)
-    print("\n[Step 2] Validating coordinate consistency...")
-    if not validate_coordinate_consistency(file_paths):
-        print("WARNING: Coordinate inconsistency detected. Proceeding anyway...")
-    else:
+    # The merge trusts the first file's grid, so this is only run on request
+    if strict_coords:
+        print("\n[Step 2] Validating coordinate consistency...")
+        if not validate_coordinate_consistency(file_paths):
+            print("ERROR: Coordinate inconsistency detected (--strict-coords)")
+            sys.exit(1)
         print("Coordinate validation passed")
+    else:
+        print("\n[Step 2] Skipping coordinate validation (use --strict-coords to enable)")
     
-    # Step 3: Read and merge NetCDF files
-    print("\n[Step 3] Reading and merging NetCDF files...")
-    try:
-        merged_data, time_years = merge_nc_files(file_paths, variable, years)
-        print(f"Merged data shape: {merged_data.shape}")
-        print(f"Dimensions: {merged_data.dims}")
-        print(f"Total time points: {len(time_years)}")
-        
-    except Exception as e:
-        print(f"ERROR: Failed to merge files: {e}")
-        sys.exit(1)
+    # When every file holds a single year, each year can be aggregated
+    # straight from its own file without building a merged dataset.
+    # The Zarr cache only applies to the merged path.
+    single_year_files = (
+        not use_cache
+        and aggregation != "all" and len(set(years)) == len(years)
+    )
     
-    # Step 4: Extract coordinate-based data
-    print("\n[Step 4] Extracting coordinate-based data...")
-    try:
-        lat, lon, data_dict = extract_coordinate_data(merged_data, time_years, aggregation)
-        print(f"Latitude range: {lat.min():.2f} to {lat.max():.2f}")
-        print(f"Longitude range: {lon.min():.2f} to {lon.max():.2f}")
-        print(f"Years processed: {sorted(data_dict.keys())}")
+    if single_year_files:
+        print("\n[Step 3] One file per year - skipping merge")
         
-    except Exception as e:
-        print(f"ERROR: Failed to extract coordinate data: {e}")
-        sys.exit(1)
+        # Step 4: Aggregate each file directly
+        print("\n[Step 4] Extracting coordinate-based data...")
+        try:
+            lat, lon, data_dict = fast_aggregate(file_paths, years, variable, aggregation)
+            
+        except Exception as e:
+            print(f"ERROR: Failed to extract coordinate data: {e}")
+            sys.exit(1)
+    else:
+        # Step 3: Read and merge NetCDF files (or load them from the cache)
+        print("\n[Step 3] Reading and merging NetCDF files...")
+        try:
+            cache_path = config.get_cache_path(model, scenario, variable) if use_cache else None
+            
+            if cache_path is not None and is_merge_cache_valid(cache_path, file_paths):
+                print(f"Loading merged data from cache: {cache_path}")
+                merged_data, time_years = load_merge_cache(cache_path, variable)
+            else:
+                merged_data, time_years = merge_nc_files(file_paths, variable, years)
+                if cache_path is not None:
+                    if cache_path.exists():
+                        print(f"Cache is out of date, rebuilding: {cache_path}")
+                    print(f"Writing merged data to cache: {cache_path}")
+                    merged_data, time_years = write_merge_cache(
+                        merged_data, cache_path, file_paths
+                    )
+            
+            print(f"Merged data shape: {merged_data.shape}")
+            print(f"Dimensions: {merged_data.dims}")
+            print(f"Total time points: {len(time_years)}")
+            
+        except Exception as e:
+            print(f"ERROR: Failed to merge files: {e}")
+            sys.exit(1)
+        
+        # Step 4: Extract coordinate-based data
+        print("\n[Step 4] Extracting coordinate-based data...")
+        try:
+            lat, lon, data_dict = extract_coordinate_data(merged_data, time_years, aggregation)
+            
+        except Exception as e:
+            print(f"ERROR: Failed to extract coordinate data: {e}")
+            sys.exit(1)
+        finally:
+            # Results are in memory now, so the NetCDF/Zarr handles can go
+            merged_data.close()
+    
+    print(f"Latitude range: {lat.min():.2f} to {lat.max():.2f}")
+    print(f"Longitude range: {lon.min():.2f} to {lon.max():.2f}")
+    print(f"Years processed: {sorted(data_dict.keys())}")
     
     # Step 5: Prepare DataFrame data
-    print("\n[Step 5] Preparing data for Excel export...")
+    print("\n[Step 5] Preparing data for export...")
     try:
-        dataframe_data = prepare_dataframe_data(lat, lon, data_dict, variable)
-        print(f"Data prepared: {len(dataframe_data['lat'])} coordinate pairs")
+        coords, values, column_names = prepare_dataframe_data(lat, lon, data_dict, variable)
+        print(f"Data prepared: {len(coords)} coordinate pairs")
         
     except Exception as e:
-        print(f"ERROR: Failed to prepare DataFrame data: {e}")
+        print(f"ERROR: Failed to prepare export data: {e}")
         sys.exit(1)
     
-    # Step 6: Export to Excel
-    print("\n[Step 6] Exporting to Excel...")
+    # Step 6: Export to the requested format
+    print(f"\n[Step 6] Exporting to {output_format}...")
     try:
-        output_path = config.get_output_path(model, scenario, variable)
-        write_to_excel(dataframe_data, output_path)
+        output_path = config.get_output_path(model, scenario, variable, output_format)
+        write_to_excel(coords, values, column_names, output_path)
         
         # Validate output
         if validate_excel_file(output_path):
-            print(f"\nSUCCESS! Excel file created: {output_path}")
+            print(f"\nSUCCESS! Output file created: {output_path}")
             return output_path
         else:
-            print(f"\nWARNING: Excel file created but validation failed: {output_path}")
+            print(f"\nWARNING: Output file created but validation failed: {output_path}")
             return output_path
             
     except Exception as e:
-        print(f"ERROR: Failed to export to Excel: {e}")
+        print(f"ERROR: Failed to export to {output_format}: {e}")
         sys.exit(1)
 
 
@@ -136,6 +200,8 @@ def main():
 Examples:
   python merge_nc_to_excel.py --model "ACCESS CM2" --scenario "SSP585" --variable "tasmax"
   python merge_nc_to_excel.py --model "ACCESS CM2" --scenario "SSP245" --variable "tasmin" --aggregation "mean"
+  python merge_nc_to_excel.py --variable "pr" --output-format csv
+  python merge_nc_to_excel.py --variable "tasmax" --aggregation "max" --cache
         """
     )
     
@@ -168,6 +234,26 @@ Examples:
         help=f'Aggregation method for time dimension (default: {config.EXCEL_AGGREGATION})'
     )
     
+    parser.add_argument(
+        '--output-format',
+        type=str,
+        choices=config.AVAILABLE_OUTPUT_FORMATS,
+        default=config.DEFAULT_OUTPUT_FORMAT,
+        help=f'Output file format (default: {config.DEFAULT_OUTPUT_FORMAT})'
+    )
+    
+    parser.add_argument(
+        '--cache',
+        action='store_true',
+        help='Cache merged data as Zarr so reruns (e.g. other aggregations) skip NetCDF reads'
+    )
+    
+    parser.add_argument(
+        '--strict-coords',
+        action='store_true',
+        help='Stop unless all files share the same lat/lon grid (not checked by default)'
+    )
+    
     parser.add_argument(
         '--validate-paths',
         action='store_true',
@@ -194,7 +280,10 @@ Examples:
             args.model,
             args.scenario,
             args.variable,
-            args.aggregation
+            args.aggregation,
+            args.strict_coords,
+            args.output_format,
+            args.cache
         )
         print(f"\n{'=' * 70}")
         print("Processing completed successfully!")
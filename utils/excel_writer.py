@@ -2,14 +2,147 @@
 Excel export utilities for coordinate-based climate data.
 """
 
+import numpy as np
+import openpyxl
 import pandas as pd
+import xlsxwriter
 from pathlib import Path
-from typing import Dict
+from typing import Dict, Iterator, List
 import config
 
+# Number of rows converted to Python values at a time when streaming
+ROW_BLOCK_SIZE = 10000
+
+# Number of rows written per batch for CSV output
+CSV_CHUNK_SIZE = 200000
+
+
+def _iter_rows(
+    coords: np.ndarray,
+    values: np.ndarray,
+    start: int,
+    end: int
+) -> Iterator[list]:
+    """
+    Yield rows of coordinates followed by values as lists of Python values.
+    
+    NaN values are yielded as None so they are written as empty cells.
+    
+    Args:
+        coords: (n_rows, 2) float64 lat/lon matrix
+        values: (n_rows, n_years) value matrix
+        start: First row index (inclusive)
+        end: Last row index (exclusive)
+    
+    Yields:
+        List of cell values for each row
+    """
+    for block_start in range(start, end, ROW_BLOCK_SIZE):
+        block_end = min(block_start + ROW_BLOCK_SIZE, end)
+        coord_rows = coords[block_start:block_end].tolist()
+        value_block = values[block_start:block_end]
+        has_nan = np.isnan(value_block).any(axis=1)
+        
+        for coord_row, row, row_has_nan in zip(coord_rows, value_block.tolist(), has_nan):
+            if row_has_nan:
+                row = [None if value != value else value for value in row]
+            yield coord_row + row
+
+
+def _columns(coords: np.ndarray, values: np.ndarray, column_names: List[str]) -> Dict:
+    """Map column names to column views, lat/lon first."""
+    columns = {'lat': coords[:, 0], 'lon': coords[:, 1]}
+    for j, name in enumerate(column_names[2:]):
+        columns[name] = values[:, j]
+    return columns
+
+
+def _write_csv(
+    coords: np.ndarray,
+    values: np.ndarray,
+    column_names: List[str],
+    output_path: Path
+) -> None:
+    """
+    Write coordinate-based data to a CSV file.
+    
+    Args:
+        coords: (n_rows, 2) float64 lat/lon matrix
+        values: (n_rows, n_years) value matrix
+        column_names: Name of each column, starting with 'lat' and 'lon'
+        output_path: Path where the CSV file should be saved
+    """
+    print(f"Writing {len(coords)} rows to CSV file: {output_path}")
+    
+    # Columns already come in lat, lon, years order, so no reordering is
+    # needed; copy=False wraps the contiguous column views as-is
+    df = pd.DataFrame(_columns(coords, values, column_names), copy=False)
+    df.to_csv(output_path, index=False, chunksize=CSV_CHUNK_SIZE)
+    
+    print(f"CSV file saved successfully: {output_path}")
+
+
+def check_output_format(output_format: str) -> None:
+    """
+    Check that the libraries needed for an output format are installed.
+    
+    Meant to be called before any data is read, so a missing optional
+    dependency doesn't surface only once processing has finished.
+    
+    Args:
+        output_format: "xlsx", "csv" or "parquet"
+    
+    Raises:
+        ImportError: If parquet is requested and pyarrow is not installed
+    """
+    if output_format != 'parquet':
+        return
+    
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError(
+            "Parquet output requires pyarrow. Install it with: pip install pyarrow"
+        )
+
+
+def _write_parquet(
+    coords: np.ndarray,
+    values: np.ndarray,
+    column_names: List[str],
+    output_path: Path
+) -> None:
+    """
+    Write coordinate-based data to a Parquet file.
+    
+    lat/lon are stored as float64 and the year columns as float32.
+    
+    Args:
+        coords: (n_rows, 2) float64 lat/lon matrix
+        values: (n_rows, n_years) value matrix
+        column_names: Name of each column, starting with 'lat' and 'lon'
+        output_path: Path where the Parquet file should be saved
+    
+    Raises:
+        ImportError: If pyarrow is not installed
+    """
+    check_output_format('parquet')
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    
+    print(f"Writing {len(coords)} rows to Parquet file: {output_path}")
+    
+    table = pa.Table.from_pydict(_columns(coords, values, column_names))
+    pq.write_table(table, output_path, compression='snappy')
+    
+    print(f"Parquet file saved successfully: {output_path}")
+
 
 def write_to_excel(
-    data_dict: Dict,
+    coords: np.ndarray,
+    values: np.ndarray,
+    column_names: List[str],
     output_path: Path,
     sheet_name: str = None,
     max_rows_per_sheet: int = None
@@ -17,18 +150,42 @@ def write_to_excel(
     """
     Write coordinate-based data to Excel file.
     
+    The format is chosen from the output file suffix: '.csv' and '.parquet'
+    are written directly, anything else is written as an Excel workbook.
+    
     Args:
-        data_dict: Dictionary with keys as column names and values as arrays
-                  Must include 'lat' and 'lon' keys
+        coords: (n_rows, 2) float64 lat/lon matrix, as returned by
+                prepare_dataframe_data()
+        values: (n_rows, n_years) value matrix, as returned by
+                prepare_dataframe_data()
+        column_names: Name of each column; must start with 'lat', 'lon'
         output_path: Path where Excel file should be saved
         sheet_name: Name of the Excel sheet (default from config)
         max_rows_per_sheet: Maximum rows per sheet (default from config)
     
     Raises:
-        ValueError: If data_dict doesn't contain 'lat' and 'lon' keys
+        ValueError: If the columns don't start with 'lat' and 'lon' or don't
+                    match the matrix shapes
+        ImportError: If '.parquet' output is requested without pyarrow
     """
-    if 'lat' not in data_dict or 'lon' not in data_dict:
-        raise ValueError("data_dict must contain 'lat' and 'lon' keys")
+    if list(column_names[:2]) != ['lat', 'lon']:
+        raise ValueError("column_names must start with 'lat' and 'lon'")
+    if (coords.ndim != 2 or values.ndim != 2 or coords.shape[1] != 2
+            or len(coords) != len(values)
+            or 2 + values.shape[1] != len(column_names)):
+        raise ValueError(
+            f"Matrix shapes {coords.shape} and {values.shape} do not match "
+            f"{len(column_names)} columns"
+        )
+    
+    output_path = Path(output_path)
+    suffix = output_path.suffix.lower()
+    if suffix == '.csv':
+        _write_csv(coords, values, column_names, output_path)
+        return
+    if suffix == '.parquet':
+        _write_parquet(coords, values, column_names, output_path)
+        return
     
     if sheet_name is None:
         sheet_name = config.EXCEL_SHEET_NAME
@@ -36,57 +193,64 @@ def write_to_excel(
     if max_rows_per_sheet is None:
         max_rows_per_sheet = config.EXCEL_MAX_ROWS_PER_SHEET
     
-    print(f"Creating DataFrame from {len(data_dict['lat'])} coordinate pairs...")
+    cols = list(column_names)
+    n_rows = len(coords)
     
-    # Create DataFrame
-    df = pd.DataFrame(data_dict)
-    
-    # Ensure lat and lon are first columns
-    cols = ['lat', 'lon'] + [c for c in df.columns if c not in ['lat', 'lon']]
-    df = df[cols]
-    
-    print(f"DataFrame shape: {df.shape}")
-    print(f"Columns: {df.columns.tolist()}")
+    print(f"Data shape: ({n_rows}, {len(cols)})")
+    print(f"Columns: {cols}")
     
     # Check if we need to split into multiple sheets
-    if len(df) > max_rows_per_sheet:
-        print(f"Warning: DataFrame has {len(df)} rows, which exceeds "
+    if n_rows > max_rows_per_sheet:
+        print(f"Warning: Data has {n_rows} rows, which exceeds "
               f"Excel's recommended limit. Splitting into multiple sheets...")
         
         # Split into multiple sheets
         # Use ceiling division to correctly calculate number of sheets needed
-        num_sheets = (len(df) + max_rows_per_sheet - 1) // max_rows_per_sheet
+        num_sheets = (n_rows + max_rows_per_sheet - 1) // max_rows_per_sheet
+        
+        # Write-only workbooks stream rows to disk instead of keeping
+        # every cell of every sheet in memory
+        workbook = openpyxl.Workbook(write_only=True)
+        for i in range(num_sheets):
+            start_idx = i * max_rows_per_sheet
+            end_idx = min((i + 1) * max_rows_per_sheet, n_rows)
+            
+            current_sheet_name = f"{sheet_name}_{i+1}" if num_sheets > 1 else sheet_name
+            worksheet = workbook.create_sheet(current_sheet_name)
+            worksheet.append(cols)
+            for row in _iter_rows(coords, values, start_idx, end_idx):
+                worksheet.append(row)
+            
+            print(f"  Written sheet '{current_sheet_name}' with {end_idx - start_idx} rows")
         
-        with pd.ExcelWriter(output_path, engine='openpyxl') as writer:
-            for i in range(num_sheets):
-                start_idx = i * max_rows_per_sheet
-                end_idx = min((i + 1) * max_rows_per_sheet, len(df))
-                
-                sheet_df = df.iloc[start_idx:end_idx]
-                current_sheet_name = f"{sheet_name}_{i+1}" if num_sheets > 1 else sheet_name
-                
-                sheet_df.to_excel(
-                    writer,
-                    sheet_name=current_sheet_name,
-                    index=False
-                )
-                
-                print(f"  Written sheet '{current_sheet_name}' with {len(sheet_df)} rows")
+        workbook.save(output_path)
     else:
-        # Single sheet
+        # Single sheet - rows are streamed directly, so constant_memory mode
+        # only keeps the current row in memory
         print(f"Writing to Excel file: {output_path}")
-        df.to_excel(output_path, sheet_name=sheet_name, index=False)
-        print(f"  Written {len(df)} rows to sheet '{sheet_name}'")
+        
+        workbook = xlsxwriter.Workbook(str(output_path), {'constant_memory': True})
+        try:
+            worksheet = workbook.add_worksheet(sheet_name)
+            worksheet.write_row(0, 0, cols)
+            for r, row in enumerate(_iter_rows(coords, values, 0, n_rows), 1):
+                worksheet.write_row(r, 0, row)
+        finally:
+            workbook.close()
+        
+        print(f"  Written {n_rows} rows to sheet '{sheet_name}'")
     
     print(f"Excel file saved successfully: {output_path}")
 
 
 def validate_excel_file(file_path: Path) -> bool:
     """
-    Validate that an Excel file was created successfully.
+    Validate that an output file was created successfully.
+    
+    CSV and Parquet files (by suffix) are checked with the matching reader.
     
     Args:
-        file_path: Path to the Excel file
+        file_path: Path to the Excel, CSV or Parquet file
     
     Returns:
         True if file exists and can be read
@@ -96,9 +260,16 @@ def validate_excel_file(file_path: Path) -> bool:
     
     try:
         # Try to read the file
-        df = pd.read_excel(file_path, nrows=1)
+        suffix = file_path.suffix.lower()
+        if suffix == '.csv':
+            pd.read_csv(file_path, nrows=1)
+        elif suffix == '.parquet':
+            import pyarrow.parquet as pq
+            pq.read_metadata(file_path)
+        else:
+            pd.read_excel(file_path, nrows=1)
         return True
     except Exception as e:
-        print(f"Warning: Could not validate Excel file: {e}")
+        print(f"Warning: Could not validate output file: {e}")
         return False
 
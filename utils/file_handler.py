@@ -2,11 +2,18 @@
 File handling utilities for discovering and organizing NetCDF files.
 """
 
+import os
 import re
 from pathlib import Path
 from typing import List, Tuple, Dict
 import config
 
+# Compiled once at import; used for every discovered file
+_YEAR_RE = re.compile(config.YEAR_PATTERN)
+
+# Only every n-th lat/lon value is compared when validating coordinates
+COORD_CHECK_STRIDE = 16
+
 
 def extract_year_from_filename(filename: str) -> int:
     """
@@ -24,13 +31,13 @@ def extract_year_from_filename(filename: str) -> int:
     Raises:
         ValueError: If year cannot be extracted from filename
     """
-    match = re.search(config.YEAR_PATTERN, filename)
+    match = _YEAR_RE.search(filename)
     if not match:
         raise ValueError(f"Could not extract year from filename: {filename}")
     return int(match.group(1))
 
 
-def discover_nc_files(model: str, scenario: str, variable: str) -> List[Tuple[Path, int]]:
+def discover_nc_files(model: str, scenario: str, variable: str) -> Tuple[Tuple[Path, int], ...]:
     """
     Discover all NetCDF files for a given model, scenario, and variable.
     
@@ -40,7 +47,7 @@ def discover_nc_files(model: str, scenario: str, variable: str) -> List[Tuple[Pa
         variable: Variable name (e.g., "tasmax")
     
     Returns:
-        List of tuples (file_path, year) sorted by year
+        Tuple of (file_path, year) pairs sorted by year
     
     Raises:
         FileNotFoundError: If the input directory does not exist
@@ -53,50 +60,55 @@ def discover_nc_files(model: str, scenario: str, variable: str) -> List[Tuple[Pa
             f"Input directory does not exist: {input_dir}"
         )
     
-    # Find all .nc files
-    nc_files = list(input_dir.glob("*.nc"))
-    
-    if not nc_files:
+    # Find all .nc files and extract their years in a single pass
+    nc_file_count = 0
+    files_with_years = []
+    with os.scandir(input_dir) as entries:
+        for entry in entries:
+            # Case-insensitive like Path.glob("*.nc") on Windows
+            if not entry.name.lower().endswith(".nc") or not entry.is_file():
+                continue
+            nc_file_count += 1
+            try:
+                year = extract_year_from_filename(entry.name)
+                files_with_years.append((Path(entry.path), year))
+            except ValueError as e:
+                print(f"Warning: {e}. Skipping file: {entry.name}")
+                continue
+    
+    if not nc_file_count:
         raise ValueError(
             f"No NetCDF files found in directory: {input_dir}"
         )
     
-    # Extract years and create tuples
-    files_with_years = []
-    for file_path in nc_files:
-        try:
-            year = extract_year_from_filename(file_path.name)
-            files_with_years.append((file_path, year))
-        except ValueError as e:
-            print(f"Warning: {e}. Skipping file: {file_path.name}")
-            continue
-    
     if not files_with_years:
         raise ValueError(
             f"Could not extract years from any files in: {input_dir}"
         )
     
-    # Sort by year
+    # Sort by year; returned as a tuple so the cached result can't be modified
     files_with_years.sort(key=lambda x: x[1])
     
-    return files_with_years
+    return tuple(files_with_years)
 
 
 def validate_coordinate_consistency(file_paths: List[Path]) -> bool:
     """
     Validate that all NetCDF files have consistent coordinate grids.
     
-    This is a basic check - full validation happens during reading.
+    Every file is compared against the first one. Grid shapes are compared
+    exactly; coordinate values are spot-checked on a strided subset (every
+    COORD_CHECK_STRIDE-th point) and may differ by less than 0.01.
     
     Args:
         file_paths: List of NetCDF file paths to validate
     
     Returns:
-        True if validation passes (or if validation cannot be performed)
+        True if all grids match, False if they differ or cannot be read
     
     Note:
-        This is a lightweight check. Full coordinate validation
-        should be done during the actual file reading process.
+        The merge itself does not compare coordinates; it uses the first
+        file's lat/lon. This check is what --strict-coords relies on.
     """
     if len(file_paths) < 2:
         return True  # Single file or no files - nothing to validate
@@ -104,32 +116,43 @@ def validate_coordinate_consistency(file_paths: List[Path]) -> bool:
     try:
         import netCDF4
         
+        # Only a strided subset of coordinate values is read and compared
+        stride = COORD_CHECK_STRIDE
+        
         # Read first file's coordinates
         with netCDF4.Dataset(file_paths[0], 'r') as nc:
-            first_lat = nc.variables['lat'][:]
-            first_lon = nc.variables['lon'][:]
+            first_lat_var, first_lon_var = nc.variables['lat'], nc.variables['lon']
+            first_shapes = (first_lat_var.shape, first_lon_var.shape)
+            first_lat_var.set_auto_mask(False)
+            first_lon_var.set_auto_mask(False)
+            first_lat = first_lat_var[::stride]
+            first_lon = first_lon_var[::stride]
         
-        # Check a few other files
-        for file_path in file_paths[1:min(5, len(file_paths))]:
+        # Check every other file against the first
+        for file_path in file_paths[1:]:
             with netCDF4.Dataset(file_path, 'r') as nc:
-                lat = nc.variables['lat'][:]
-                lon = nc.variables['lon'][:]
+                lat_var, lon_var = nc.variables['lat'], nc.variables['lon']
                 
-                if not (len(lat) == len(first_lat) and len(lon) == len(first_lon)):
-                    print(f"Warning: Coordinate dimensions differ between files")
+                if (lat_var.shape, lon_var.shape) != first_shapes:
+                    print(f"Warning: Coordinate dimensions differ in file: {file_path}")
                     return False
                 
+                lat_var.set_auto_mask(False)
+                lon_var.set_auto_mask(False)
+                lat = lat_var[::stride]
+                lon = lon_var[::stride]
+                
                 # Check if coordinates match (with tolerance)
                 if not (abs(lat - first_lat).max() < 0.01 and 
                         abs(lon - first_lon).max() < 0.01):
-                    print(f"Warning: Coordinate values differ between files")
+                    print(f"Warning: Coordinate values differ in file: {file_path}")
                     return False
         
         return True
     
     except Exception as e:
         print(f"Warning: Could not validate coordinate consistency: {e}")
-        return True  # Don't fail on validation errors, let the reader handle it
+        return False
 
 
 def get_file_info(model: str, scenario: str, variable: str) -> Dict:
@@ -144,6 +167,7 @@ def get_file_info(model: str, scenario: str, variable: str) -> Dict:
     Returns:
         Dictionary with file information:
         - input_directory: Path to input directory
+        - files: Tuple of (file_path, year) pairs sorted by year
         - file_count: Number of files found
         - years: List of years found
         - year_range: Tuple of (min_year, max_year)
@@ -155,6 +179,7 @@ def get_file_info(model: str, scenario: str, variable: str) -> Dict:
     
     return {
         'input_directory': str(input_dir),
+        'files': files_with_years,
         'file_count': len(files_with_years),
         'years': years,
         'year_range': (min(years), max(years)) if years else None
@@ -0,0 +1,114 @@
+"""
+Compiled reduction kernels for the direct netCDF4 aggregation path.
+
+Numba is optional. When it is not installed, numpy implementations with the
+same results are used instead.
+"""
+
+import numpy as np
+
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+
+def _accumulate_numpy(
+    arr: np.ndarray,
+    fill: float,
+    total: np.ndarray,
+    count: np.ndarray,
+    scratch: np.ndarray
+) -> None:
+    """numpy fallback for accumulate_over_time()."""
+    valid = arr == arr  # False only for NaN
+    if not np.isnan(fill):
+        valid &= arr != fill
+    
+    # Masked reductions go into the caller's scratch buffer, so no (lat, lon)
+    # temporaries are allocated per block
+    np.add.reduce(arr, axis=0, dtype=np.float64, out=scratch, where=valid)
+    np.add(total, scratch, out=total)
+    np.add.reduce(valid, axis=0, dtype=np.float64, out=scratch)
+    np.add(count, scratch, out=count, casting='unsafe')
+
+
+if NUMBA_AVAILABLE:
+    # Released GIL lets the thread pool in fast_aggregate() run several
+    # kernels at once, one per file. fastmath is limited to flags that keep
+    # NaN comparisons intact, since NaN and fill values must be skipped.
+    @njit(nogil=True, cache=True, fastmath={'reassoc', 'contract', 'arcp', 'nsz'})
+    def _accumulate_numba(arr, fill, total, count):
+        n_t, n_y, n_x = arr.shape
+        
+        # Time is the outer loop so the (time, lat, lon) array is read
+        # in memory order
+        for t in range(n_t):
+            for y in range(n_y):
+                for x in range(n_x):
+                    v = arr[t, y, x]
+                    if v != fill and v == v:
+                        total[y, x] += v
+                        count[y, x] += 1
+
+
+def accumulate_over_time(
+    arr: np.ndarray,
+    fill: float,
+    total: np.ndarray,
+    count: np.ndarray,
+    scratch: np.ndarray = None
+) -> None:
+    """
+    Add a block of time steps to running per-cell sums and counts.
+    
+    Fill values and NaN are skipped. Masking and accumulation happen in a
+    single pass over the raw values, so no unpacked float copy of the input
+    is needed. Call repeatedly for consecutive blocks of a file, then
+    finalize_mean() once.
+    
+    Args:
+        arr: Raw (time, lat, lon) block as read from the file
+        fill: Fill value in the same units as arr (NaN if there is none)
+        total: (lat, lon) float64 running sums, updated in place
+        count: (lat, lon) int32 running counts of valid values, updated in place
+        scratch: (lat, lon) float64 work buffer for the numpy fallback; pass
+                 the same one for every block of a file to avoid per-block
+                 allocations. Allocated here if not given.
+    
+    Raises:
+        ValueError: If arr is not 3D or its grid doesn't match total/count
+    """
+    # The numba kernel does no bounds checking, so a mismatched grid would
+    # write past the accumulators into neighbouring memory
+    if arr.ndim != 3 or arr.shape[1:] != total.shape or total.shape != count.shape:
+        raise ValueError(
+            f"Input grid {arr.shape[1:]} does not match output grid {total.shape}"
+        )
+    
+    if NUMBA_AVAILABLE:
+        _accumulate_numba(arr, np.float64(fill), total, count)
+    else:
+        if scratch is None:
+            scratch = np.empty(total.shape, dtype=np.float64)
+        _accumulate_numpy(arr, fill, total, count, scratch)
+
+
+def finalize_mean(total: np.ndarray, count: np.ndarray, out: np.ndarray) -> np.ndarray:
+    """
+    Turn sums and counts from accumulate_over_time() into means.
+    
+    Cells with no valid values end up as 0/0 = NaN.
+    
+    Args:
+        total: (lat, lon) float64 sums
+        count: (lat, lon) int32 counts
+        out: Preallocated (lat, lon) float32 array that receives the result
+    
+    Returns:
+        out
+    """
+    with np.errstate(invalid='ignore'):
+        np.divide(total, count, out=out)
+    return out
@@ -2,34 +2,38 @@
 NetCDF reading and processing utilities using xarray.
 """
 
+import json
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import nullcontext
+import netCDF4
 import numpy as np
 import xarray as xr
 from pathlib import Path
 from typing import List, Tuple, Dict
 import config
+from utils.kernels import accumulate_over_time, finalize_mean
 
 
-def read_nc_file(file_path: Path, variable_name: str = None) -> xr.Dataset:
+def _disk_chunks(data_array: xr.DataArray) -> Dict[str, int]:
     """
-    Read a single NetCDF file using xarray.
+    Build a dask chunk mapping matching the variable's on-disk chunking.
+    
+    Falls back to config.CHUNK_SIZE when the variable is stored contiguously
+    and has no chunk sizes in its encoding.
     
     Args:
-        file_path: Path to the NetCDF file
-        variable_name: Name of the variable to extract (if None, returns full dataset)
+        data_array: DataArray opened from a NetCDF file
     
     Returns:
-        xarray Dataset or DataArray
+        Dictionary mapping dimension names to chunk sizes
     """
-    ds = xr.open_dataset(file_path, chunks=config.CHUNK_SIZE)
-    
-    if variable_name:
-        if variable_name not in ds.data_vars:
-            raise ValueError(
-                f"Variable '{variable_name}' not found in file: {file_path}"
-            )
-        return ds[variable_name]
-    
-    return ds
+    chunksizes = data_array.encoding.get('chunksizes')
+    if chunksizes and len(chunksizes) == data_array.ndim:
+        return dict(zip(data_array.dims, chunksizes))
+    return {dim: size for dim, size in config.CHUNK_SIZE.items() if dim in data_array.dims}
 
 
 def merge_nc_files(
@@ -46,82 +50,220 @@ def merge_nc_files(
         years: Optional list of years corresponding to each file
     
     Returns:
-        Tuple of (merged DataArray, list of years for each time point)
+        Tuple of (merged DataArray, list of years for each time point).
+        The DataArray is lazy; call its close() once it is no longer needed.
     
     Raises:
-        ValueError: If coordinates are inconsistent across files
+        ValueError: If no files are given or the variable is missing
+        RuntimeError: If the files cannot be opened
+    
+    Note:
+        Coordinates are neither compared nor aligned across files; the
+        first file's lat/lon are used for the merged result. Use
+        validate_coordinate_consistency() beforehand to check them.
     """
     if not file_paths:
         raise ValueError("No file paths provided")
     
     print(f"Reading {len(file_paths)} NetCDF files...")
     
-    # Read all files
-    datasets = []
-    for i, file_path in enumerate(file_paths):
-        print(f"  Reading file {i+1}/{len(file_paths)}: {file_path.name}")
-        try:
-            da = read_nc_file(file_path, variable_name)
-            datasets.append(da)
-        except Exception as e:
-            raise RuntimeError(
-                f"Error reading file {file_path}: {e}"
-            )
+    # Map each file name to its year so every time step can be tagged
+    # with the year of the file it came from
+    year_by_name = {}
+    if years:
+        year_by_name = {Path(fp).name: year for fp, year in zip(file_paths, years)}
     
-    # Validate coordinate consistency
-    if len(datasets) > 1:
-        first_coords = {
-            'lat': datasets[0].coords['lat'].values,
-            'lon': datasets[0].coords['lon'].values
-        }
-        
-        for i, da in enumerate(datasets[1:], 1):
-            lat_match = np.allclose(
-                da.coords['lat'].values,
-                first_coords['lat'],
-                atol=0.01
-            )
-            lon_match = np.allclose(
-                da.coords['lon'].values,
-                first_coords['lon'],
-                atol=0.01
+    def _preprocess(ds: xr.Dataset) -> xr.Dataset:
+        # Keep only the requested variable so other time-dependent variables
+        # (e.g. time_bnds) are not concatenated into the graph
+        source = Path(ds.encoding.get('source', '')).name
+        if variable_name in ds.data_vars:
+            ds = ds[[variable_name]]
+        if source in year_by_name:
+            ds = ds.assign_coords(
+                file_year=('time', np.full(ds.sizes['time'], year_by_name[source]))
             )
-            
-            if not (lat_match and lon_match):
-                raise ValueError(
-                    f"Coordinate mismatch detected in file {i+1}. "
-                    "All files must have the same lat/lon grid."
-                )
+        return ds
+    
+    # Open all files as a single lazy dataset; dask handles the concatenation
+    # and file metadata is read in parallel, with file handles managed by
+    # xarray rather than held in a list. compat='override' and
+    # join='override' trust the first file's lat/lon instead of comparing
+    # or aligning them across every file. chunks={} uses the chunking
+    # stored in the files.
+    try:
+        ds = xr.open_mfdataset(
+            file_paths,
+            engine='netcdf4',
+            combine='nested',
+            concat_dim='time',
+            parallel=True,
+            chunks={},
+            data_vars='minimal',
+            coords='minimal',
+            compat='override',
+            join='override',
+            mask_and_scale=True,
+            preprocess=_preprocess
+        )
+    except Exception as e:
+        raise RuntimeError(f"Error reading NetCDF files: {e}")
+    
+    if variable_name not in ds.data_vars:
+        raise ValueError(
+            f"Variable '{variable_name}' not found in files: {file_paths[0].parent}"
+        )
     
-    # Concatenate along time dimension
-    print("Merging files along time dimension...")
-    merged = xr.concat(datasets, dim='time')
+    # Align dask chunks with the on-disk chunks of the variable and work
+    # in float32 rather than xarray's default float64 decoding
+    merged = ds[variable_name]
+    merged = merged.chunk(_disk_chunks(merged)).astype(np.float32, copy=False)
+    # Closing the merged DataArray releases all underlying file handles
+    merged.set_close(ds.close)
+    print(f"Merged {len(file_paths)} files along time dimension")
     
     # Create year array for each time point
-    # Each file has 365 days, so we assign the corresponding year to each day
-    time_years = []
-    if years:
-        for i, year in enumerate(years):
-            # Assume 365 days per file (or get actual length)
-            days_in_file = len(datasets[i])
-            time_years.extend([year] * days_in_file)
+    if 'file_year' in merged.coords:
+        time_years = merged.coords['file_year'].values.tolist()
     else:
         # Try to extract from time coordinates
         try:
-            import pandas as pd
-            time_index = pd.to_datetime(merged.coords['time'].values)
-            time_years = time_index.year.tolist()
-        except:
-            # Fallback: assume sequential years starting from first file
+            time_years = merged['time'].dt.year.values.tolist()
+        except Exception:
+            # Fallback: assume sequential years starting from 2000
             print("Warning: Could not determine years. Using sequential years.")
-            for i in range(len(datasets)):
-                days_in_file = len(datasets[i])
-                # This is a fallback - not ideal
-                time_years.extend([2000 + i] * days_in_file)
+            days_per_file = max(1, len(merged['time']) // len(file_paths))
+            time_years = [2000 + i // days_per_file for i in range(len(merged['time']))]
     
     return merged, time_years
 
 
+def _source_manifest(file_paths: List[Path]) -> str:
+    """
+    Describe the input files (name, size, modification time) as a JSON string.
+    
+    Stored with the cache so a cache built from different or modified files
+    is not reused.
+    
+    Args:
+        file_paths: NetCDF files the merged data was built from
+    
+    Returns:
+        JSON string
+    """
+    entries = []
+    for file_path in file_paths:
+        stat = os.stat(file_path)
+        entries.append([Path(file_path).name, stat.st_size, stat.st_mtime_ns])
+    return json.dumps(entries)
+
+
+def write_merge_cache(
+    merged: xr.DataArray,
+    cache_path: Path,
+    file_paths: List[Path]
+) -> Tuple[xr.DataArray, List[int]]:
+    """
+    Write merged data to a Zarr cache and reopen it from there.
+    
+    The data is rechunked to config.CACHE_CHUNK_SIZE (whole grid per chunk
+    of days) to match how extract_coordinate_data() reduces over time. The
+    store is written to a temporary sibling path and only moved into place
+    once complete, so an interrupted write never leaves a partial cache.
+    Any existing (e.g. stale) cache at cache_path is replaced.
+    
+    Args:
+        merged: Merged DataArray from merge_nc_files(); closed once written
+        cache_path: Path of the Zarr store to create
+        file_paths: NetCDF files the data was merged from, recorded so that
+                    is_merge_cache_valid() can detect changed inputs
+    
+    Returns:
+        Tuple of (cached DataArray, list of years for each time point)
+    """
+    chunks = {dim: size for dim, size in config.CACHE_CHUNK_SIZE.items() if dim in merged.dims}
+    ds = merged.chunk(chunks).to_dataset(name=merged.name)
+    # Chunk settings carried over from the NetCDF files don't apply to Zarr
+    ds[merged.name].encoding = {}
+    ds.attrs['source_files'] = _source_manifest(file_paths)
+    
+    tmp_path = cache_path.with_name(cache_path.name + '.tmp')
+    if tmp_path.exists():
+        shutil.rmtree(tmp_path)
+    
+    try:
+        ds.to_zarr(tmp_path, mode='w', consolidated=True)
+    except BaseException:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+    finally:
+        merged.close()
+    
+    if cache_path.exists():
+        shutil.rmtree(cache_path)
+    os.replace(tmp_path, cache_path)
+    
+    return load_merge_cache(cache_path, merged.name)
+
+
+def is_merge_cache_valid(cache_path: Path, file_paths: List[Path]) -> bool:
+    """
+    Check that a Zarr cache exists and was built from the given files.
+    
+    Args:
+        cache_path: Path of the Zarr store
+        file_paths: NetCDF files the merged data should come from
+    
+    Returns:
+        True if the cache can be used; False if it is missing, unreadable,
+        or the input files have changed since it was written
+    """
+    if not cache_path.exists():
+        return False
+    
+    try:
+        with xr.open_zarr(cache_path, consolidated=True) as ds:
+            recorded = ds.attrs.get('source_files')
+        return recorded == _source_manifest(file_paths)
+    except Exception as e:
+        print(f"Warning: Could not read cache {cache_path}: {e}")
+        return False
+
+
+def load_merge_cache(
+    cache_path: Path,
+    variable_name: str
+) -> Tuple[xr.DataArray, List[int]]:
+    """
+    Load merged data previously written by write_merge_cache().
+    
+    Args:
+        cache_path: Path of the Zarr store
+        variable_name: Name of the cached variable
+    
+    Returns:
+        Tuple of (cached DataArray, list of years for each time point)
+    
+    Raises:
+        ValueError: If the variable is not in the cache
+    """
+    ds = xr.open_zarr(cache_path, consolidated=True)
+    
+    if variable_name not in ds.data_vars:
+        raise ValueError(
+            f"Variable '{variable_name}' not found in cache: {cache_path}"
+        )
+    
+    cached = ds[variable_name]
+    cached.set_close(ds.close)
+    if 'file_year' in cached.coords:
+        time_years = cached.coords['file_year'].values.tolist()
+    else:
+        time_years = cached['time'].dt.year.values.tolist()
+    
+    return cached, time_years
+
+
 def extract_coordinate_data(
     data_array: xr.DataArray,
     time_years: List[int],
@@ -152,26 +294,241 @@ def extract_coordinate_data(
     
     print(f"Aggregating data for {len(unique_years)} years...")
     
-    for year in unique_years:
-        year_mask = years == year
-        # Convert boolean mask to integer indices for isel()
-        year_indices = np.where(year_mask)[0]
-        year_data = data_array.isel(time=year_indices)
+    if aggregation in ("mean", "max", "min"):
+        # Reduce all years in one dask graph so time chunks are read once
+        year_coord = xr.DataArray(years, dims='time', name='year')
+        grouped = data_array.groupby(year_coord)
+        result = getattr(grouped, aggregation)(dim='time').compute()
         
-        if aggregation == "mean":
-            aggregated = year_data.mean(dim='time').values
-        elif aggregation == "max":
-            aggregated = year_data.max(dim='time').values
-        elif aggregation == "min":
-            aggregated = year_data.min(dim='time').values
-        elif aggregation == "all":
-            # Keep all time steps - this creates a larger array
-            aggregated = year_data.values  # Shape: (days, lat, lon)
-        else:
-            raise ValueError(f"Unknown aggregation method: {aggregation}")
-        
-        data_dict[int(year)] = aggregated
-        print(f"  Processed year {year}")
+        for year in result['year'].values:
+            data_dict[int(year)] = result.sel(year=year).values
+            print(f"  Processed year {year}")
+    elif aggregation == "all":
+        # Keep all time steps - this creates a larger array
+        for year in unique_years:
+            year_indices = np.where(years == year)[0]
+            data_dict[int(year)] = data_array.isel(time=year_indices).values  # Shape: (days, lat, lon)
+            print(f"  Processed year {year}")
+    else:
+        raise ValueError(f"Unknown aggregation method: {aggregation}")
+    
+    return lat, lon, data_dict
+
+
+# netCDF-C/HDF5 are usually built without thread-safety, so file access is
+# serialized unless config says otherwise. The numpy reductions still run
+# concurrently since they release the GIL.
+_NC_LOCK = threading.Lock()
+
+# Aggregations supported by fast_aggregate(). max/min are combined across
+# time blocks with fmax/fmin, which skip NaN like xarray's default skipna;
+# mean is accumulated with utils.kernels.accumulate_over_time.
+_FAST_AGGREGATIONS = ('mean', 'max', 'min')
+_SKIPNA_COMBINERS = {
+    'max': np.fmax,
+    'min': np.fmin
+}
+
+
+def _packing_attrs(nc_var: netCDF4.Variable) -> Dict:
+    """
+    Get the packing attributes of a netCDF4 variable and disable auto unpacking.
+    
+    Args:
+        nc_var: netCDF4 variable to read raw values from
+    
+    Returns:
+        Dictionary with the fill value, scale factor and offset needed by
+        _unpack() and _apply_scale()
+    """
+    nc_var.set_auto_maskandscale(False)
+    return {
+        'fill_value': getattr(nc_var, '_FillValue', getattr(nc_var, 'missing_value', None)),
+        'scale_factor': getattr(nc_var, 'scale_factor', None),
+        'add_offset': getattr(nc_var, 'add_offset', None)
+    }
+
+
+def _unpack(raw: np.ndarray, attrs: Dict) -> np.ndarray:
+    """
+    Convert raw NetCDF values to float32 with fill values replaced by NaN.
+    
+    Args:
+        raw: Raw array read after _packing_attrs()
+        attrs: Packing attributes from _packing_attrs()
+    
+    Returns:
+        float32 numpy array
+    """
+    fill_value = attrs['fill_value']
+    missing = raw == fill_value if fill_value is not None else None
+    
+    data = raw.astype(np.float32, copy=False)
+    if missing is not None and missing.any():
+        data[missing] = np.nan
+    
+    return _apply_scale(data, attrs)
+
+
+def _apply_scale(data: np.ndarray, attrs: Dict) -> np.ndarray:
+    """
+    Apply scale_factor and add_offset to a float32 array in place.
+    
+    Args:
+        data: float32 array of packed values
+        attrs: Packing attributes from _packing_attrs()
+    
+    Returns:
+        data
+    """
+    if attrs['scale_factor'] is not None:
+        data *= np.float32(attrs['scale_factor'])
+    if attrs['add_offset'] is not None:
+        data += np.float32(attrs['add_offset'])
+    return data
+
+
+def _reduce_one(
+    file_path: Path,
+    variable_name: str,
+    aggregation: str,
+    out: np.ndarray
+) -> None:
+    """
+    Read one file and reduce its time axis into a preallocated output slice.
+    
+    The file is read in blocks of config.TIME_BLOCK_SIZE time steps, so
+    memory use per file is bounded by one block rather than a whole year.
+    
+    Args:
+        file_path: Path to the NetCDF file
+        variable_name: Name of the variable to reduce
+        aggregation: "mean", "max" or "min"
+        out: (lat, lon) float32 array that receives the result
+    
+    Raises:
+        ValueError: If the variable is missing from the file or its grid
+                    doesn't match out
+        RuntimeError: If the file cannot be read
+    """
+    lock = nullcontext() if config.NETCDF_THREADSAFE else _NC_LOCK
+    
+    if aggregation == "mean":
+        total = np.zeros(out.shape, dtype=np.float64)
+        count = np.zeros(out.shape, dtype=np.int32)
+        scratch = np.empty(out.shape, dtype=np.float64)
+    else:
+        combine = _SKIPNA_COMBINERS[aggregation]
+        block_result = np.empty_like(out)
+        out.fill(np.nan)
+    
+    try:
+        # Opening, reading and closing hold the lock; reductions run concurrently
+        with lock:
+            nc = netCDF4.Dataset(file_path, 'r')
+        try:
+            with lock:
+                if variable_name not in nc.variables:
+                    raise ValueError(
+                        f"Variable '{variable_name}' not found in file: {file_path}"
+                    )
+                nc_var = nc.variables[variable_name]
+                # Checked from metadata before any data is read
+                if nc_var.ndim != 3 or nc_var.shape[1:] != out.shape:
+                    raise ValueError(
+                        f"Grid {nc_var.shape[1:]} of '{variable_name}' in file {file_path} "
+                        f"does not match the first file's grid {out.shape}"
+                    )
+                attrs = _packing_attrs(nc_var)
+                n_time = nc_var.shape[0]
+            fill_value = attrs['fill_value']
+            
+            for start in range(0, n_time, config.TIME_BLOCK_SIZE):
+                with lock:
+                    raw = nc_var[start:start + config.TIME_BLOCK_SIZE]
+                
+                if aggregation == "mean":
+                    # Mean is linear in the packed values, so it is accumulated
+                    # over the raw values and unpacked afterwards
+                    accumulate_over_time(
+                        raw, np.nan if fill_value is None else fill_value,
+                        total, count, scratch
+                    )
+                else:
+                    combine.reduce(_unpack(raw, attrs), axis=0, out=block_result)
+                    combine(out, block_result, out=out)
+        finally:
+            with lock:
+                nc.close()
+    except ValueError:
+        raise
+    except Exception as e:
+        raise RuntimeError(f"Error reading file {file_path}: {e}")
+    
+    if aggregation == "mean":
+        finalize_mean(total, count, out)
+        _apply_scale(out, attrs)
+
+
+def fast_aggregate(
+    file_paths: List[Path],
+    years: List[int],
+    variable_name: str,
+    aggregation: str = "mean"
+) -> Tuple[np.ndarray, np.ndarray, Dict[int, np.ndarray]]:
+    """
+    Aggregate the time dimension of each file directly with netCDF4 and numpy.
+    
+    Intended for the common case where each file holds a single year, so the
+    merge step can be skipped. Files are processed concurrently in a pool of
+    up to config.MAX_WORKERS threads, each reading its file in blocks of
+    config.TIME_BLOCK_SIZE time steps. Equivalent to merge_nc_files() followed
+    by extract_coordinate_data() for "mean", "max" and "min". The variable is
+    expected to have dimensions (time, lat, lon).
+    
+    Args:
+        file_paths: List of NetCDF file paths, one per year
+        years: Year corresponding to each file
+        variable_name: Name of the variable to aggregate
+        aggregation: "mean", "max" or "min"
+    
+    Returns:
+        Tuple of (lat_array, lon_array, data_dict)
+        where data_dict is {year: aggregated_values_array}
+    
+    Raises:
+        ValueError: If inputs are inconsistent, a file's grid differs from the
+                    first file's, or the aggregation is unsupported
+        RuntimeError: If a file cannot be read
+    """
+    if not file_paths:
+        raise ValueError("No file paths provided")
+    if len(file_paths) != len(years):
+        raise ValueError("file_paths and years must have the same length")
+    if aggregation not in _FAST_AGGREGATIONS:
+        raise ValueError(f"Unsupported aggregation for fast path: {aggregation}")
+    
+    # Coordinates are taken from the first file; every other file must have
+    # the same grid size
+    with netCDF4.Dataset(file_paths[0], 'r') as nc:
+        lat = np.asarray(nc.variables['lat'][:])
+        lon = np.asarray(nc.variables['lon'][:])
+    
+    out = np.empty((len(years), len(lat), len(lon)), dtype=np.float32)
+    
+    max_workers = min(config.MAX_WORKERS, len(file_paths))
+    print(f"Aggregating {len(file_paths)} files directly ({max_workers} threads)...")
+    
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(_reduce_one, file_path, variable_name, aggregation, out[i]): year
+            for i, (file_path, year) in enumerate(zip(file_paths, years))
+        }
+        for future in as_completed(futures):
+            future.result()
+            print(f"  Processed year {futures[future]}")
+    
+    data_dict = {int(year): out[i] for i, year in enumerate(years)}
     
     return lat, lon, data_dict
 
@@ -181,12 +538,14 @@ def prepare_dataframe_data(
     lon: np.ndarray,
     data_dict: Dict[int, np.ndarray],
     variable_name: str
-) -> Dict:
+) -> Tuple[np.ndarray, np.ndarray, List[str]]:
     """
-    Prepare data in a format suitable for pandas DataFrame.
+    Prepare data as a table ready for export.
     
     Creates a structure where each row represents a unique (lat, lon) pair,
-    and columns represent years.
+    and columns represent years. Coordinates and values are written into
+    two preallocated matrices instead of one array per column: lat/lon keep
+    float64 precision, while the year values are float32.
     
     Args:
         lat: Latitude array
@@ -195,37 +554,44 @@ def prepare_dataframe_data(
         variable_name: Name of the variable (for column naming)
     
     Returns:
-        Dictionary with keys: 'lat', 'lon', and year columns
+        Tuple of (coords, values, column_names) where coords has shape
+        (n_lat * n_lon, 2) holding lat and lon, values has shape
+        (n_lat * n_lon, n_years), and column_names starts with 'lat' and
+        'lon' followed by one column per year
     """
     n_lat, n_lon = len(lat), len(lon)
+    n_points = n_lat * n_lon
+    years = sorted(data_dict)
     
-    # Create meshgrid for coordinates
-    lon_grid, lat_grid = np.meshgrid(lon, lat)
+    # Column-major so each column is contiguous; columns are filled one at
+    # a time here and read per column by the CSV/Parquet writers
+    coords = np.empty((n_points, 2), dtype=np.float64, order='F')
+    values = np.empty((n_points, len(years)), dtype=np.float32, order='F')
     
-    # Flatten coordinates
-    lat_flat = lat_grid.flatten()
-    lon_flat = lon_grid.flatten()
+    def grid_view(matrix: np.ndarray, j: int) -> np.ndarray:
+        # (lat, lon) view of column j, rows in row-major (lat, lon) order
+        return matrix[:, j].reshape(n_lat, n_lon)
     
-    # Prepare data dictionary
-    result = {
-        'lat': lat_flat,
-        'lon': lon_flat
-    }
+    # Coordinates are broadcast straight into their columns, no meshgrid
+    grid_view(coords, 0)[...] = lat[:, np.newaxis]
+    grid_view(coords, 1)[...] = lon[np.newaxis, :]
+    
+    column_names = ['lat', 'lon']
     
     # Add data for each year
-    for year, data_array in sorted(data_dict.items()):
+    for j, year in enumerate(years):
+        data_array = data_dict[year]
+        
         # Handle different data shapes
         if data_array.ndim == 2:  # (lat, lon) - aggregated data
-            data_flat = data_array.flatten()
+            grid_view(values, j)[...] = data_array
         elif data_array.ndim == 3:  # (time, lat, lon) - all days
             # For "all" aggregation, we might want to keep daily data
-            # For now, flatten the first dimension
-            data_flat = data_array.reshape(-1, n_lat * n_lon).mean(axis=0)
+            # For now, average over the first dimension
+            data_array.mean(axis=0, dtype=np.float32, out=grid_view(values, j))
         else:
             raise ValueError(f"Unexpected data array shape: {data_array.shape}")
         
-        column_name = f"{variable_name}_{year}"
-        result[column_name] = data_flat
+        column_names.append(f"{variable_name}_{year}")
     
-    return result
-
+    return coords, values, column_names